@@ -2,136 +2,135 @@
 The program obtains the path to the file or directory via command-line arguments:
 > python code_analyzer.py directory-or-file
 """
-from collections import deque
-from os import scandir
-from sys import argv
+from io import StringIO
+from itertools import chain
+from multiprocessing import Pool
+from operator import itemgetter
+from os import cpu_count, scandir
+from sys import argv, stdout
 import ast
 import re
 
+_MUTABLE_DEFAULT_TYPES = (ast.List, ast.Dict, ast.Set)
+_DEF_RE = re.compile(r" *(?P<construction_name>def|class)(?P<space>\s+?)(?P<entity_name>\w+)"
+                     r"\(?(?P<arguments>[\w\s,:]*)\)?:")
+
+
+def find_extra_semicolon(string):
+    """Looks for and return index of extra semicolon in string.
+    Single pass: semicolons inside quotes or after an inline comment are skipped.
+    """
+    in_single_quotes = in_double_quotes = False
+    escaped = False
+    for index, char in enumerate(string):
+        if escaped:  # The character after a backslash in quotes can't close them.
+            escaped = False
+        elif char == '\\' and (in_single_quotes or in_double_quotes):
+            escaped = True
+        elif char == "'" and not in_double_quotes:
+            in_single_quotes = not in_single_quotes
+        elif char == '"' and not in_single_quotes:
+            in_double_quotes = not in_double_quotes
+        elif not (in_single_quotes or in_double_quotes):
+            if char == '#':
+                return None
+            if char == ';':
+                return index
+    return None
+
+
+def check_line_length(output: list, prefix: str, string: str) -> None:
+    """ Checks the length of the line. The string comes without the line end."""
+    if len(string) > 79:
+        output.append(prefix + "S001 Too long line.")
+
+
+def check_indentation(output: list, prefix: str, string: str) -> None:
+    """ Checks the size of indentation."""
+    if (len(string) - len(string.lstrip(' '))) % 4 != 0:
+        output.append(prefix + "S002 Indentation is not a multiple of four.")
+
+
+def check_semicolon(output: list, prefix: str, string: str) -> None:
+    """ Checks is there an unnecessary semicolon after a statement."""
+    if ';' in string and find_extra_semicolon(string) is not None:
+        output.append(prefix + "S003 Unnecessary semicolon after a statement.")
+
+
+def check_comment_spaces(output: list, prefix: str, string: str, hash_index: int, stripped_line: str) -> None:
+    """ Checks how many spaces are before inline comment."""
+    if hash_index != -1 and not stripped_line.startswith('#') and not string[:hash_index].endswith("  "):
+        output.append(prefix + "S004 At least two spaces before inline comments required.")
+
+
+def check_is_todo(output: list, prefix: str, string: str, hash_index: int) -> None:
+    """ Checks _TODO marks in comments."""
+    if hash_index != -1:
+        comment = string[hash_index + 1:].casefold()
+        if "todo" in comment:
+            output.append(prefix + "S005 TODO found.")
+
+
+def check_blank_lines(output: list, prefix: str, string: str, blank_lines_counter: int) -> int:
+    """ Checks how mane blank lines are used before this line. Returns the updated blank lines counter."""
+    if string[:1] in ('\n', '\r'):  # The lines keep their ends, so a blank line starts with one of them.
+        return blank_lines_counter + 1
+    if blank_lines_counter == 3:
+        output.append(prefix + "S006 More than two blank lines used before this line.")
+    return 0
+
 
 class CodeAnalyzer(ast.NodeVisitor):
     def __init__(self) -> None:
         self.path: str = ""
-        self.directory_path: str = ""
-        self.string: str = ""
-        self.line_number: int = 1
-        self.match_object = None
-        self.last_3_lines_queue: deque = deque()
-        self.blank_lines_counter: int = 0
-        self.hash_index: int = 0
-        self.warning_queue: deque = deque()
+        self.output: list = []  # Warnings of the current file, they are written at once after the checks.
+        self.warning_queue: list = []  # (line number, message), sorted once the AST is visited
         self.file_list_of_lines: list = []
         self.file_text: str = ''
+        self.source_lines: list = []
 
-    def refresh_hash_index(self) -> int:
-        if '#' in self.string:
-            return self.string.index('#')
-        else:
-            return len(self.string)
-
-    def check_line_length(self) -> None:
-        """ Checks the length of the line."""
-        if len(self.string) > 79:
-            print(f"{self.path}: Line {self.line_number}: S001 Too long line.")
-
-    def check_indentation(self) -> None:
-        """ Checks the size of indentation."""
-        whitespace_counter = 0
-        string = self.string
-        while string.startswith(" "):
-            string = string[1:len(string)]
-            whitespace_counter += 1
-        if whitespace_counter % 4 != 0:
-            print(f"{self.path}: Line {self.line_number}: S002 Indentation is not a multiple of four.")
-
-    def check_semicolon(self) -> None:
-        """ Checks is there an unnecessary semicolon after a statement."""
-        if ';' in self.string and self.find_extra_semicolon(self.string):
-            print(f"{self.path}: Line {self.line_number}: S003 Unnecessary semicolon after a statement.")
-        return None
-
-    def check_comment_spaces(self) -> None:
-        """ Checks how many spaces are before inline comment."""
-        if '#' in self.string:
-            if self.string.lstrip().startswith('#'):
-                return None
-            elif self.string[:self.hash_index].endswith("  "):
-                return None
-            else:
-                print(f"{self.path}: "
-                      f"Line {self.line_number}: S004 At least two spaces before inline comments required.")
-        return None
-
-    def check_is_todo(self) -> None:
-        """ Checks _TODO marks in comments."""
-        if '#' in self.string:
-            comment = self.string[self.hash_index + 1:].casefold()
-            if "todo" in comment:
-                print(f"{self.path}: Line {self.line_number}: S005 TODO found.")
-
-    def check_blank_lines(self) -> None:
-        """ Checks how mane blank lines are used before this line."""
-        self.last_3_lines_queue.append(self.string)
-        if len(self.last_3_lines_queue) > 4:  # We don't need to keep long list, 4 strings are enough.
-            self.last_3_lines_queue.popleft()
-        if self.string.startswith(('\n', '\r')):
-            self.blank_lines_counter += 1
-        else:
-            if self.blank_lines_counter == 3:
-                print(f"{self.path}: Line {self.line_number}: S006 More than two blank lines used before this line.")
-            self.blank_lines_counter = 0
-
-    def check_definition_spaces(self) -> None:
+    def check_definition_spaces(self, match_object, prefix: str) -> None:
         """ Checks how many spaces is after '%construction_name%' (def or class)."""
-        if len(self.match_object.group("space")) > 1:
-            print(f"{self.path}: Line {self.line_number}: "
-                  f"S007 Too many spaces after '{self.match_object.group('construction_name')}'.")
+        if len(match_object.group("space")) > 1:
+            self.output.append(f"{prefix}S007 Too many spaces after '{match_object.group('construction_name')}'.")
 
-    def is_camel_case(self, name: str):
-        """ If name in CamelCase style return match object, else None."""
-        return re.match(r"[A-Z][a-z]+[A-Z]?[a-z]+", name)
+    def is_camel_case(self, name: str) -> bool:
+        """ If name in CamelCase style return True, else False."""
+        return name[:1].isupper() and '_' not in name
 
-    def is_snake_case(self, name: str):
-        """ If name in snake_case style return match object, else None."""
-        return re.match(r"_{,2}?[a-z]+[0-9]?_?[a-z]?[0-9]?", name)
+    def is_snake_case(self, name: str) -> bool:
+        """ If name in snake_case style return True, else False. Leading underscores are allowed."""
+        body = name.lstrip('_')
+        return body[:1].islower() and all(char.islower() or char.isdigit() or char == '_' for char in body)
 
-    def check_class_name(self) -> None:
+    def check_class_name(self, match_object, prefix: str) -> None:
         """ Checks the class name in CamelCase style or not.
         match_object contains groups' names: construction_name, space, entity_name, arguments.
-        Source of groups is get_groups() function.
+        Source of groups is _DEF_RE pattern, run_checks() calls it only for 'class'.
         """
-        if self.match_object.group('construction_name') != "class":
-            return None
-        for class_name in (self.match_object.group("entity_name"), self.match_object.group("arguments")):
+        for class_name in (match_object.group("entity_name"), match_object.group("arguments")):
             if len(class_name) == 0:
                 return None
             if not self.is_camel_case(class_name):
-                print(f"{self.path}: Line {self.line_number}: S008 Class name '{class_name}' should use CamelCase.")
+                self.output.append(f"{prefix}S008 Class name '{class_name}' should use CamelCase.")
 
-    def check_function_name(self) -> None:
-        """ Checks the function name in snake_case style or not."""
-        if self.match_object.group("construction_name") != "def":
-            return None
-        function_name = self.match_object.group("entity_name")
+    def check_function_name(self, match_object, prefix: str) -> None:
+        """ Checks the function name in snake_case style or not. run_checks() calls it only for 'def'."""
+        function_name = match_object.group("entity_name")
         if not self.is_snake_case(function_name):
-            print(f"{self.path}: Line {self.line_number}: S009 Function name '{function_name}' should use snake_case.")
-
-    def _get_groups(self):
-        # Returns one or more subgroups of the match or None.
-        return re.match(
-            r" *(?P<construction_name>def|class)(?P<space>\s+?)(?P<entity_name>[\w]+)\(?(?P<arguments>[\w\s,:]*)\)?:",
-            self.string)
+            self.output.append(f"{prefix}S009 Function name '{function_name}' should use snake_case.")
 
     def check_argument_name(self, node) -> None:
         """Checks argument name in snake_case or not."""
-        for item in ast.walk(node.args):
-            # print("node.args dump", ast.dump(item, include_attributes=True))
-            if isinstance(item, ast.arg):
-                if not self.is_snake_case(item.arg):
-                    self.warning_queue.append((item.lineno,
-                                               f"{self.path}: Line {item.lineno}: S010 Argument name "
-                                               f"'{item.arg}' should use snake_case."))
-                    break
+        arguments = node.args
+        # The same order as ast.walk(node.args) gives, but without visiting annotations and defaults.
+        for item in chain(arguments.posonlyargs, arguments.args, (arguments.vararg,),
+                          arguments.kwonlyargs, (arguments.kwarg,)):
+            if item is not None and not self.is_snake_case(item.arg):
+                self.warning_queue.append((item.lineno,
+                                           f"{self.path}: Line {item.lineno}: S010 Argument name "
+                                           f"'{item.arg}' should use snake_case."))
+                break
 
     def check_local_variable_name(self, node) -> None:
         """Checks variable names in functions in snake_case or not."""
@@ -156,17 +155,12 @@ class CodeAnalyzer(ast.NodeVisitor):
     def is_default_argument_mutable(self, node) -> None:
         """Checks the default argument value is mutable of not."""
         # print("dump", ast.dump(node, include_attributes=False))
-        arguments_list = deque()
-        if node.args.kw_defaults:
-            arguments_list.extend(node.args.kw_defaults)
-        if node.args.defaults:
-            arguments_list.extend(node.args.defaults)
-        for defaults in arguments_list:
-            for mutable_type in (ast.List, ast.Dict, ast.Set):
-                if isinstance(defaults, mutable_type):
-                    self.warning_queue.append((defaults.lineno, f"{self.path}: Line {defaults.lineno}: "
-                                               f"S012 Default argument value is mutable."))
-                    return None
+        for defaults in chain(node.args.kw_defaults, node.args.defaults):
+            # kw_defaults contains None for keyword-only arguments without a default, isinstance() skips it.
+            if isinstance(defaults, _MUTABLE_DEFAULT_TYPES):
+                self.warning_queue.append((defaults.lineno, f"{self.path}: Line {defaults.lineno}: "
+                                           f"S012 Default argument value is mutable."))
+                return None
 
     def visit_FunctionDef(self, node):
         """It's iterates through FunctionDef nodes of AST and runs preparation of S010-S012 warning_queue,
@@ -175,109 +169,103 @@ class CodeAnalyzer(ast.NodeVisitor):
         self.check_argument_name(node)
         self.check_local_variable_name(node)
         self.is_default_argument_mutable(node)
-        self.warning_queue = deque(sorted(self.warning_queue, key=lambda x: x[0]))
 
-    def check_warning_queue(self):
-        while len(self.warning_queue) and self.warning_queue[0][0] == self.line_number:
-            print(self.warning_queue.popleft()[1])
+    def check_warning_queue(self, line_number: int, warning_index: int) -> int:
+        """Moves the warnings of the line to output. Returns the index of the first warning of the next lines."""
+        warning_queue = self.warning_queue
+        while warning_index < len(warning_queue) and warning_queue[warning_index][0] == line_number:
+            self.output.append(warning_queue[warning_index][1])
+            warning_index += 1
+        return warning_index
 
     def fix_indentation_error(self, error_message):
         """Fixes indentation error in parsed file."""
-        self.create_working_source()
         error_location = int(error_message.lineno) - 1
         self.file_list_of_lines[error_location] = self.file_list_of_lines[error_location].lstrip()
-        self.file_text = ''.join(self.file_list_of_lines)
-
-    def find_extra_semicolon(self, string):
-        """Looks for and return index of extra semicolon in string."""
-        semicolon_index = -1
-        if '#' in string:
-            hash_index = string.find('#')
-        else:
-            hash_index = len(string)
-        semicolon_amount = string.count(';')
-        if string.count('#') == 0:
-            hash_amount = 1
-        else:
-            hash_amount = string.count(';')
-        for _ in range(semicolon_amount):
-            semicolon_index = string.find(';', semicolon_index + 1)
-            for _ in range(hash_amount):
-                if semicolon_index > hash_index  \
-                        or '"' in string[semicolon_index + 1: hash_index] \
-                        or "'" in string[semicolon_index + 1: hash_index]:
-                    if hash_amount > 1:
-                        hash_index = string.find('#', hash_index + 1)
-                    continue
-                else:
-                    return semicolon_index
 
     def fix_syntax_error(self, error_message):
         """Removes an extra semicolon from string."""
-        self.create_working_source()
         error_location = int(error_message.lineno) - 1
-        semicolon_index = self.find_extra_semicolon(self.file_list_of_lines[error_location])
+        semicolon_index = find_extra_semicolon(self.file_list_of_lines[error_location])
         self.file_list_of_lines[error_location] = self.file_list_of_lines[error_location][:semicolon_index]\
                                                   + self.file_list_of_lines[error_location][semicolon_index + 1:]
-        self.file_text = ''.join(self.file_list_of_lines)
-
-    def create_working_source(self):
-        """Initializes an attribute."""
-        self.file_list_of_lines = self.file_text.splitlines(keepends=True)
 
     def built_ast(self):
-        """Builds the AST and fix_indentation_error, if it occurs."""
+        """Builds the AST and fix_indentation_error, if it occurs.
+        The file is split into lines once, the fixes change only file_list_of_lines,
+        so source_lines and file_text keep the original source.
+        """
         with open(self.path) as file:
             self.file_text = file.read()
+        # Unlike str.splitlines(), it splits only at '\n', as the tokenizer does, so line numbers match the AST.
+        self.source_lines = StringIO(self.file_text).readlines()
+        self.file_list_of_lines = self.source_lines.copy()
+        text = self.file_text
         while True:
             try:
-                tree = ast.parse(self.file_text)
+                tree = ast.parse(text)
                 return tree
             except IndentationError as error_message:
                 self.fix_indentation_error(error_message)
             except SyntaxError as error_message:
                 self.fix_syntax_error(error_message)
+            text = ''.join(self.file_list_of_lines)
 
-    def run_checks(self) -> None:
-        """Refreshes class attributes and runs the all PEP8 checks for every single line."""
+    def run_checks(self) -> str:
+        """Refreshes class attributes and runs the all PEP8 checks for every single line.
+        Returns the warnings of the file as one string.
+        """
+        self.warning_queue = []
         tree = self.built_ast()
         self.generic_visit(tree)  # generic_visit() method runs visit_FunctionDef() function.
-        with open(self.path) as file2:
-            for line in file2:
-                self.string: str = line
-                self.match_object = self._get_groups()
-                self.hash_index: int = self.refresh_hash_index()
-                self.check_line_length()
-                self.check_indentation()
-                self.check_semicolon()
-                self.check_comment_spaces()
-                self.check_is_todo()
-                self.check_blank_lines()
-                if self.match_object is not None:
-                    self.check_definition_spaces()
-                    self.check_class_name()
-                    self.check_function_name()
-                self.check_warning_queue()
-                self.line_number += 1
+        self.warning_queue.sort(key=itemgetter(0))  # The sort is stable: S010-S012 order of a line is kept.
+        warning_index = 0
+        # The hot loop works with local variables only, the checks get everything they need as arguments.
+        path = self.path
+        output = self.output = []
+        def_match = _DEF_RE.match
+        blank_lines_counter = 0
+        line_number = 1
+        for line in self.source_lines:
+            prefix = f"{path}: Line {line_number}: "
+            match_object = def_match(line)
+            string = line.rstrip('\r\n')  # The line end isn't a part of the line length.
+            hash_index = string.find('#')  # The line is scanned once and the result is shared by the checks.
+            check_line_length(output, prefix, string)
+            check_indentation(output, prefix, string)
+            check_semicolon(output, prefix, string)
+            if hash_index != -1:  # Most lines have no comment, so they don't need to be stripped.
+                check_comment_spaces(output, prefix, string, hash_index, string.lstrip())
+                check_is_todo(output, prefix, string, hash_index)
+            blank_lines_counter = check_blank_lines(output, prefix, line, blank_lines_counter)
+            if match_object is not None:
+                self.check_definition_spaces(match_object, prefix)
+                if match_object.group("construction_name") == "def":
+                    self.check_function_name(match_object, prefix)
+                else:  # _DEF_RE matches only 'def' or 'class'.
+                    self.check_class_name(match_object, prefix)
+            warning_index = self.check_warning_queue(line_number, warning_index)
+            line_number += 1
+        return "".join(warning + "\n" for warning in output)
 
     def check_path(self) -> None:
         """The path can lead to a file or to a directory.
         The function checks what is it and choose a proper way work.
         """
         if self.path.endswith(".py"):
-            self.run_checks()
+            stdout.write(self.run_checks())
         else:
-            self.directory_path = self.path
-            entries_list = []
             with scandir(self.path) as entries_iterator:
-                for entry in entries_iterator:
-                    if entry.is_file():
-                        entries_list.append(str(entry.name))
-            entries_list.sort()
-            for file_name in entries_list:
-                self.path = f"{self.directory_path}/{file_name}"
-                self.line_number = 1
-                self.run_checks()
+                entries_list = sorted(entry.path for entry in entries_iterator
+                                      if entry.is_file() and entry.name.endswith(".py"))
+            # Files are independent, so they are checked in parallel. imap keeps the sorted order of the output,
+            # which is written with a single call. Starting the workers costs more than it saves on few files.
+            processors = cpu_count() or 1
+            if processors == 1 or len(entries_list) < 2 * processors:
+                stdout.write("".join(map(analyze_file, entries_list)))
+            else:
+                with Pool() as pool:
+                    stdout.write("".join(pool.imap(analyze_file, entries_list, chunksize=8)))
 
     def run(self) -> None:
         """ If number of CL arguments is correct runs the programme.
@@ -293,6 +281,15 @@ class CodeAnalyzer(ast.NodeVisitor):
             print("The number of passed arguments is incorrect.")
 
 
+def analyze_file(path: str) -> str:
+    """Checks a single file with a fresh CodeAnalyzer, so nothing leaks from another file.
+    It's a module-level function to be picklable for the Pool workers.
+    """
+    code_analyzer = CodeAnalyzer()
+    code_analyzer.path = path
+    return code_analyzer.run_checks()
+
+
 if __name__ == '__main__':
     code_analyzer_ = CodeAnalyzer()
     code_analyzer_.run()